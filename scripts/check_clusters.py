@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+from detect_conjunctions import detect_close_approaches_kdtree, detect_clusters_kdtree
+
+# sanity check for detect_clusters_kdtree: on a synthetic train plus crossers, the
+# per-pair stats must equal the plain pair summary, and the thinned events must still
+# contain every newly formed pair and every pair under pair_threshold_km.
+
+THRESHOLD_KM = 5.0
+PAIR_THRESHOLD_KM = 0.5
+N_STEPS = 40
+
+
+def make_traj():
+    # train of 8 satellites 3 km apart along x; satellite 2 sits beside the train and
+    # slides toward satellite 0 (a new pair forming inside the cluster, ending under
+    # PAIR_THRESHOLD_KM); satellite 200 crosses the train along y; 300 never comes close.
+    t0 = pd.Timestamp("2026-01-01")
+    rows = []
+    for k in range(N_STEPS):
+        t = t0 + pd.Timedelta(minutes=k)
+        for pos, i in enumerate([0, 1, 3, 4, 5, 6, 7, 8]):
+            rows.append({"satnum": i, "x_km": 7000.0 + 3.0 * pos + 0.2 * np.sin(0.3 * k + i), "y_km": 0.0})
+        f = np.clip((k - 10) / 20.0, 0.0, 1.0)
+        rows.append({"satnum": 2, "x_km": 7004.0 - 3.7 * f, "y_km": 3.5 - 3.4 * f})
+        rows.append({"satnum": 200, "x_km": 7010.0, "y_km": -60.0 + 3.0 * k})
+        rows.append({"satnum": 300, "x_km": 7500.0, "y_km": 0.0})
+        for r in rows[-11:]:
+            r.update({"time_utc": t, "z_km": 0.0, "alt_km": 600.0, "sgp4_err": 0})
+    return pd.DataFrame(rows)
+
+
+def ordered(events: pd.DataFrame) -> pd.DataFrame:
+    lo = np.minimum(events["satnum_a"], events["satnum_b"])
+    hi = np.maximum(events["satnum_a"], events["satnum_b"])
+    return events.assign(satnum_a=lo, satnum_b=hi)
+
+
+def main():
+    traj = make_traj()
+    kw = {"threshold_km": THRESHOLD_KM, "alt_bin_km": 50.0, "leobound_km": 2000.0}
+
+    plain = ordered(detect_close_approaches_kdtree(traj, **kw))
+    events, clusters, pairs = detect_clusters_kdtree(traj, pair_threshold_km=PAIR_THRESHOLD_KM, **kw)
+    events = ordered(events)
+    print(f"plain events: {len(plain)}, cluster-mode events: {len(events)}, clusters: {len(clusters)}")
+
+    # 1. pair stats match the plain-mode groupby on ordered pairs
+    expected = (
+        plain.groupby(["satnum_a", "satnum_b"], as_index=False)
+        .agg(
+            n_detections=("distance_km", "size"),
+            min_distance_km=("distance_km", "min"),
+            first_time=("time_utc", "min"),
+            last_time=("time_utc", "max"),
+        )
+    )
+    got = pairs.sort_values(["satnum_a", "satnum_b"]).reset_index(drop=True)
+    assert len(got) == len(expected), "pair count differs from plain mode"
+    assert (got[["satnum_a", "satnum_b"]].to_numpy() == expected[["satnum_a", "satnum_b"]].to_numpy()).all()
+    assert (got["n_detections"].to_numpy() == expected["n_detections"].to_numpy()).all()
+    assert np.allclose(got["min_distance_km"], expected["min_distance_km"])
+    assert (got["first_time"].to_numpy() == expected["first_time"].to_numpy()).all()
+    assert (got["last_time"].to_numpy() == expected["last_time"].to_numpy()).all()
+
+    # 2. every pair that was absent at the previous timestep survives the thinning
+    times = np.sort(traj["time_utc"].unique())
+    step = {t: k for k, t in enumerate(times)}
+    plain = plain.assign(step=plain["time_utc"].map(step))
+    seen = set(zip(plain["satnum_a"], plain["satnum_b"], plain["step"]))
+    is_new = [(a, b, s - 1) not in seen for a, b, s in zip(plain["satnum_a"], plain["satnum_b"], plain["step"])]
+    kept = set(zip(events["satnum_a"], events["satnum_b"], events["time_utc"]))
+    must_keep = plain[np.array(is_new) | (plain["distance_km"] < PAIR_THRESHOLD_KM)]
+    dropped = [r for r in must_keep.itertuples() if (r.satnum_a, r.satnum_b, r.time_utc) not in kept]
+    assert not dropped, f"{len(dropped)} new or under-threshold pair events were dropped"
+    assert ((0, 2) in set(zip(must_keep["satnum_a"], must_keep["satnum_b"]))), "pair 0-2 never formed"
+
+    # 3. the cluster holding the train reports pair 0-2 as its closest pair
+    train = clusters[clusters["members"].apply(lambda m: 0 in m)]
+    assert len(train) == 1
+    assert (train["min_pair_a"].iloc[0], train["min_pair_b"].iloc[0]) == (0, 2)
+    assert len(events) < len(plain)
+
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+from sgp4.api import Satrec, WGS72, jday
+from ensemble import ensemble_miss_distances, SGP4_EPOCH_JD
+
+# sanity checks for ensemble_miss_distances:
+# 1. with zero sigmas every sample is the nominal trajectory, so the reported miss distance
+#    must match a brute-force closest approach (not the coarse grid minimum), whatever the
+#    screening step.
+# 2. for two copies of the same object, the miss distance at the encounter is the norm of
+#    the difference of two independent RIC offsets, so its RMS must be
+#    sqrt(2 * (sigma_r^2 + sigma_i^2 + sigma_c^2)), however long after the TLE epoch.
+
+TLE_1 = "1 25544U 98067A   19343.69339541  .00001764  00000-0  38792-4 0  9991"
+TLE_2 = "2 25544  51.6439 211.2001 0007417  17.6667  85.6398 15.50103472202482"
+TOL_KM = 0.005
+SPREAD_TOL = 0.07  # relative tolerance on the RMS miss distance
+SPREAD_SAMPLES = 2000
+
+
+def make_crossing_pair():
+    # ISS-like object and a copy tilted ~15 deg (~2 km/s relative speed), offset slightly
+    # along-track and in altitude so they pass ~0.5 km apart near the node.
+    a = Satrec.twoline2rv(TLE_1, TLE_2)
+    b = Satrec()
+    b.sgp4init(
+        WGS72, "i", 99999, a.jdsatepoch + a.jdsatepochF - SGP4_EPOCH_JD,
+        a.bstar, a.ndot, a.nddot, a.ecco, a.argpo,
+        a.inclo + np.radians(15.0), a.mo + 2.0 / 6790.0,
+        a.no_kozai * (6790.0 / (6790.0 - 1.0)) ** 1.5, a.nodeo,
+    )
+    return a, b
+
+
+def brute_force_tca(a: Satrec, b: Satrec, t0: pd.Timestamp, hours: float):
+    # 1 s scan, then 1 ms scan around the best second
+    jd0, fr0 = jday(t0.year, t0.month, t0.day, t0.hour, t0.minute, t0.second)
+
+    def dist(offsets_s):
+        jd = np.full(len(offsets_s), jd0)
+        fr = fr0 + offsets_s / 86400.0
+        _, ra, _ = a.sgp4_array(jd, fr)
+        _, rb, _ = b.sgp4_array(jd, fr)
+        return np.linalg.norm(ra - rb, axis=1)
+
+    coarse = np.arange(0.0, hours * 3600.0, 1.0)
+    k = dist(coarse).argmin()
+    fine = np.arange(coarse[k] - 2.0, coarse[k] + 2.0, 0.001)
+    d = dist(fine)
+    return t0 + pd.Timedelta(seconds=fine[d.argmin()]), d.min()
+
+
+def check_zero_sigma():
+    a, b = make_crossing_pair()
+    t0 = pd.Timestamp("2019-12-09 16:40")  # just after the TLE epoch
+    tca, truth_km = brute_force_tca(a, b, t0, hours=1.0)
+    print(f"brute-force closest approach: {truth_km:.4f} km at {tca}")
+
+    sat_df = pd.DataFrame([{"satnum": 25544, "satrec": a}, {"satnum": 99999, "satrec": b}])
+
+    for step_minutes in (1.0, 5.0):
+        detected = tca.floor(f"{step_minutes:g}min")
+        pair_df = pd.DataFrame([{
+            "satnum_a": 25544,
+            "satnum_b": 99999,
+            "first_time": detected,
+            "last_time": detected,
+        }])
+        summary, samples = ensemble_miss_distances(
+            pair_df, sat_df,
+            n_samples=3,
+            step_minutes=step_minutes,
+            sigma_along_km=0.0,
+            sigma_radial_km=0.0,
+            sigma_cross_km=0.0,
+            return_samples=True,
+        )
+        err_km = np.abs(samples["miss_distance_km"].to_numpy() - truth_km).max()
+        print(f"step={step_minutes:g} min: miss_p50_km={summary['miss_p50_km'].iloc[0]:.4f}, max error {err_km * 1000:.2f} m")
+        assert err_km < TOL_KM, f"zero-sigma miss distance off by {err_km:.4f} km at step {step_minutes:g} min"
+
+
+def check_spread():
+    sat = Satrec.twoline2rv(TLE_1, TLE_2)
+    sat_df = pd.DataFrame([{"satnum": 25544, "satrec": sat}, {"satnum": 99998, "satrec": sat}])
+    epoch = pd.Timestamp("2019-12-09 16:38:29")
+
+    for days in (0.5, 1.0, 3.0):
+        t_enc = (epoch + pd.Timedelta(days=days)).floor("min")
+        pair_df = pd.DataFrame([{
+            "satnum_a": 25544,
+            "satnum_b": 99998,
+            "first_time": t_enc,
+            "last_time": t_enc,
+            "time_of_min": t_enc,
+        }])
+        for sigmas in ((1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0), (1.0, 0.2, 0.2)):
+            sigma_along, sigma_radial, sigma_cross = sigmas
+            _, samples = ensemble_miss_distances(
+                pair_df, sat_df,
+                n_samples=SPREAD_SAMPLES,
+                step_minutes=0.25,
+                pad_minutes=0.0,
+                sigma_along_km=sigma_along,
+                sigma_radial_km=sigma_radial,
+                sigma_cross_km=sigma_cross,
+                return_samples=True,
+            )
+            expected = np.sqrt(2.0 * np.sum(np.square(sigmas)))
+            rms = np.sqrt(np.mean(np.square(samples["miss_distance_km"])))
+            print(f"+{days:g} d, sigmas (along, radial, cross) = {sigmas}: RMS miss {rms:.3f} km, expected {expected:.3f} km")
+            assert abs(rms / expected - 1.0) < SPREAD_TOL, f"ensemble spread {rms:.3f} km, expected {expected:.3f} km"
+
+
+def main():
+    check_zero_sigma()
+    check_spread()
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
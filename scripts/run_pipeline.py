@@ -3,7 +3,8 @@ import pandas as pd
 import os
 from load_tle import read_tle_file  # use your actual function name if different
 from propagate import make_time_grid, propagate_many
-from detect_conjunctions import detect_close_approaches_kdtree
+from detect_conjunctions import detect_close_approaches_kdtree, detect_clusters_kdtree
+from ensemble import ensemble_miss_distances
 
 
 def main():
@@ -16,6 +17,10 @@ def main():
     alt_bin_km = 50.0
     leobound_km = 2000.0
     flush_every = 10
+    cluster_mode = False                  # compress co-orbital trains into cluster records
+    pair_threshold_km = 1.0               # in cluster mode, always keep pairs closer than this
+    ensemble_samples = 0                  # Monte Carlo samples per object for TLE uncertainty (0 = off)
+    ensemble_max_pairs = 500              # only screen the closest candidate pairs
 
     # ---- LOAD ----
     sat_df = read_tle_file(tle_path)
@@ -37,17 +42,43 @@ def main():
 
     # ---- DETECT (stream to parquet parts) ----
     events_out = f"data/events_{hours}h_{step_minutes}min_thr{threshold_km:g}.parquet"
-    _ = detect_close_approaches_kdtree(
-        traj_df=traj_df,
-        threshold_km=threshold_km,
-        alt_bin_km=alt_bin_km,
-        leobound_km=leobound_km,
-        out_parquet_path=events_out,
-        flush_every=flush_every)
+    if cluster_mode:
+        _ = detect_clusters_kdtree(
+            traj_df=traj_df,
+            threshold_km=threshold_km,
+            alt_bin_km=alt_bin_km,
+            leobound_km=leobound_km,
+            pair_threshold_km=pair_threshold_km,
+            out_parquet_path=events_out,
+            flush_every=flush_every)
+    else:
+        _ = detect_close_approaches_kdtree(
+            traj_df=traj_df,
+            threshold_km=threshold_km,
+            alt_bin_km=alt_bin_km,
+            leobound_km=leobound_km,
+            out_parquet_path=events_out,
+            flush_every=flush_every)
     
     print("Wrote event parts like:", events_out.replace(".parquet", ".part*.parquet"))
 
     import glob
+    cluster_summary_path = None
+    ensemble_summary_path = None
+    if cluster_mode:
+        cluster_parts = sorted(glob.glob(events_out.replace(".parquet", ".clusters.part*.parquet")))
+        if cluster_parts:
+            cluster_summary = (
+                pd.concat([pd.read_parquet(p) for p in cluster_parts], ignore_index=True)
+                .sort_values(["min_distance_km", "n_timesteps"], ascending=[True, False])
+            )
+            os.system(f"rm -f {events_out.replace('.parquet','')}.clusters.part*.parquet")
+
+            cluster_summary_path = f"data/cluster_summary_thr{threshold_km:g}_{hours}h_{step_minutes}min.parquet"
+            cluster_summary.to_parquet(cluster_summary_path, index=False)
+            print("Wrote:", cluster_summary_path)
+            print(cluster_summary.head(10))
+
     parts = sorted(glob.glob(events_out.replace(".parquet", ".part*.parquet")))
     if not parts:
         print("No events found; pair summary not created.")
@@ -62,17 +93,31 @@ def main():
     #else:
     #    events_df = pd.DataFrame()
     if len(events_df):
-        pair_summary = (
-            events_df
-            .groupby(["satnum_a", "satnum_b"], as_index=False)
-            .agg(
-                n_detections=("distance_km", "size"),
-                min_distance_km=("distance_km", "min"),
-                first_time=("time_utc", "min"),
-                last_time=("time_utc", "max"),
+        if cluster_mode:
+            # events are thinned in cluster mode, so use the tracker's exact per-pair stats
+            pairstats_path = events_out.replace(".parquet", ".pairstats.parquet")
+            pair_summary = (
+                pd.read_parquet(pairstats_path)
+                .sort_values(["min_distance_km", "n_detections"], ascending=[True, False])
+            )
+            os.remove(pairstats_path)
+        else:
+            pair_summary = (
+                events_df
+                .groupby(["satnum_a", "satnum_b"], as_index=False)
+                .agg(
+                    n_detections=("distance_km", "size"),
+                    min_distance_km=("distance_km", "min"),
+                    first_time=("time_utc", "min"),
+                    last_time=("time_utc", "max"),
+                )
+                .sort_values(["min_distance_km", "n_detections"], ascending=[True, False])
             )
-            .sort_values(["min_distance_km", "n_detections"], ascending=[True, False])
-        )
+            closest = events_df.loc[
+                events_df.groupby(["satnum_a", "satnum_b"])["distance_km"].idxmin(),
+                ["satnum_a", "satnum_b", "time_utc"],
+            ].rename(columns={"time_utc": "time_of_min"})
+            pair_summary = pair_summary.merge(closest, on=["satnum_a", "satnum_b"], how="left")
         pair_summary["duration_minutes"] = (
             (pair_summary["last_time"] - pair_summary["first_time"])
             .dt.total_seconds() / 60.0
@@ -83,6 +128,21 @@ def main():
         pair_summary.to_parquet(pair_summary_path, index=False)
         print("Wrote:", pair_summary_path)
         print(pair_summary.head(10))
+
+        # ---- ENSEMBLE (TLE uncertainty on candidate pairs only) ----
+        # uses its own screening step and refines each sample to the closest approach;
+        # pair windows come from first_time/last_time and sigmas apply at time_of_min,
+        # both exact in cluster mode too
+        if ensemble_samples > 0:
+            ensemble_summary = ensemble_miss_distances(
+                pair_summary,
+                sat_df,
+                n_samples=ensemble_samples,
+                max_pairs=ensemble_max_pairs)
+            ensemble_summary_path = f"data/ensemble_summary_thr{threshold_km:g}_{hours}h_{step_minutes}min.parquet"
+            ensemble_summary.to_parquet(ensemble_summary_path, index=False)
+            print("Wrote:", ensemble_summary_path)
+            print(ensemble_summary.head(10))
     else:
         print("No events found; pair summary not created.")
     manifest_path = "data/latest_run.txt"
@@ -96,6 +156,10 @@ def main():
         f.write(f"threshold_km={threshold_km}\n")
         f.write(f"alt_bin_km={alt_bin_km}\n")
         f.write(f"leobound_km={leobound_km}\n")
+        if cluster_summary_path:
+            f.write(f"cluster_summary_path={cluster_summary_path}\n")
+        if ensemble_summary_path:
+            f.write(f"ensemble_summary_path={ensemble_summary_path}\n")
 
     print("Wrote run manifest:", manifest_path)
 
@@ -1,6 +1,8 @@
 import numpy as np
 import pandas as pd
 from typing import Optional
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 from scipy.spatial import cKDTree
 
 """
@@ -10,6 +12,15 @@ from scipy.spatial import cKDTree
       ['time_utc','satnum','x_km','y_km','z_km','alt_km','sgp4_err']
 
     If out_parquet_path is provided, writes results to part files and returns empty df.
+
+    detect_clusters_kdtree runs the same per-timestep pair search, but groups each
+    timestep's pairs into connected components ("clusters") that are tracked over time.
+    It always returns (events_df, clusters_df, pairs_df). Pair events are only kept when
+    a pair first appears, its cluster membership changes, or its distance is below
+    pair_threshold_km. pairs_df holds exact per-pair stats (n_detections,
+    min_distance_km, time_of_min, first_time, last_time) over every detection.
+    With out_parquet_path, events go to <out>.part*, clusters to <out>.clusters.part*,
+    pair stats to <out>.pairstats.parquet, and three empty frames are returned.
 """
 
 def _pairs_cross_within_threshold(posA: np.ndarray, posB: np.ndarray, r: float):
@@ -25,16 +36,184 @@ def _pairs_cross_within_threshold(posA: np.ndarray, posB: np.ndarray, r: float):
             pairs.append((i, j))
     return np.asarray(pairs, dtype=int)
 
-def detect_close_approaches_kdtree(
-    traj_df: pd.DataFrame,
-    *,
-    threshold_km: float,
-    alt_bin_km: float,
-    leobound_km: float,
-    require_sgp4_ok: bool = True,
-    out_parquet_path: Optional[str] = None,
-    flush_every: int = 50,
-) -> pd.DataFrame:
+def _pair_keys(sat_a: np.ndarray, sat_b: np.ndarray) -> np.ndarray:
+    # order-independent int64 key per pair: (low satnum << 32) | high satnum
+    lo = np.minimum(sat_a, sat_b).astype(np.int64)
+    hi = np.maximum(sat_a, sat_b).astype(np.int64)
+    return (lo << 32) | hi
+
+class _ClusterTracker:
+    # groups each timestep's pairs into connected components and follows them over time.
+    # a component inherits the id of the previous cluster it shares the most members with.
+    # running per-pair stats are kept so the pair summary stays exact in this mode.
+
+    def __init__(self, pair_threshold_km: Optional[float]):
+        self.pair_threshold_km = pair_threshold_km if pair_threshold_km is not None else 0.0
+        self.prev_sats = np.empty(0, dtype=np.int64)       # sorted satnums at the previous timestep
+        self.prev_cids = np.empty(0, dtype=np.int64)       # their cluster ids
+        self.prev_pair_keys = np.empty(0, dtype=np.int64)  # pair keys seen at the previous timestep
+        self.open = {}         # cluster_id -> running cluster record
+        self.closed = []       # finished cluster records, ready to write
+        self.pair_stats = {}   # pair key -> [n, min_km, time_of_min, first, last]
+        self.next_id = 0
+
+    def update(self, t, step_events: list) -> list:
+        # consume one timestep of pair events, return the pair events worth keeping.
+
+        if not step_events:
+            self._close(set(self.open))
+            self._reset_prev()
+            return []
+
+        sat_a = np.fromiter((e["satnum_a"] for e in step_events), dtype=np.int64, count=len(step_events))
+        sat_b = np.fromiter((e["satnum_b"] for e in step_events), dtype=np.int64, count=len(step_events))
+        dists = np.fromiter((e["distance_km"] for e in step_events), dtype=float, count=len(step_events))
+        keys = _pair_keys(sat_a, sat_b)
+
+        sats, inv = np.unique(np.concatenate([sat_a, sat_b]), return_inverse=True)
+        ia, ib = inv[: len(sat_a)], inv[len(sat_a):]
+        graph = coo_matrix((np.ones(len(ia)), (ia, ib)), shape=(len(sats), len(sats)))
+        n_comp, labels = connected_components(graph, directed=False)
+        comp_size = np.bincount(labels, minlength=n_comp)
+
+        # per-component pair stats: closest pair (event index) and pair count
+        pair_labels = labels[ia]
+        by_comp = np.lexsort((dists, pair_labels))
+        _, first_idx = np.unique(pair_labels[by_comp], return_index=True)
+        comp_best = by_comp[first_idx]
+        comp_pairs = np.bincount(pair_labels, minlength=n_comp)
+
+        # previous cluster id of each satellite (-1 if it was not in a cluster)
+        prev_cid = np.full(len(sats), -1, dtype=np.int64)
+        if len(self.prev_sats):
+            pos = np.minimum(np.searchsorted(self.prev_sats, sats), len(self.prev_sats) - 1)
+            found = self.prev_sats[pos] == sats
+            prev_cid[found] = self.prev_cids[pos[found]]
+
+        # (component, previous cluster) overlap counts
+        m = prev_cid >= 0
+        span = int(prev_cid.max()) + 1 if m.any() else 1
+        combo, counts = np.unique(labels[m].astype(np.int64) * span + prev_cid[m], return_counts=True)
+        cand_comp, cand_cid = combo // span, combo % span
+
+        # match components to previous clusters, largest components first, then largest overlap
+        order = np.lexsort((cand_cid, -counts, cand_comp, -comp_size[cand_comp]))
+        comp_id = np.full(n_comp, -1, dtype=np.int64)
+        comp_overlap = np.zeros(n_comp, dtype=np.int64)
+        claimed = set()
+        for c, cid, n in zip(cand_comp[order].tolist(), cand_cid[order].tolist(), counts[order].tolist()):
+            if comp_id[c] < 0 and cid not in claimed:
+                comp_id[c] = cid
+                comp_overlap[c] = n
+                claimed.add(cid)
+        new = comp_id < 0
+        comp_id[new] = self.next_id + np.arange(int(new.sum()))
+        self.next_id += int(new.sum())
+
+        self._close(set(self.open) - claimed)
+
+        # members per component, grouped once; only walked when a cluster gains members
+        sats_by_comp = sats[np.argsort(labels, kind="stable")]
+        offsets = np.concatenate([[0], np.cumsum(comp_size)])
+
+        for c, cid in enumerate(comp_id.tolist()):
+            rec = self.open.get(cid)
+            if rec is None:
+                rec = {
+                    "cluster_id": cid,
+                    "first_time": t,
+                    "last_time": t,
+                    "n_timesteps": 0,
+                    "members": set(),
+                    "max_members": 0,
+                    "min_distance_km": np.inf,
+                    "min_pair_a": -1,
+                    "min_pair_b": -1,
+                    "min_pair_time": t,
+                    "n_pair_detections": 0,
+                }
+                self.open[cid] = rec
+            rec["last_time"] = t
+            rec["n_timesteps"] += 1
+            if comp_overlap[c] < comp_size[c]:
+                rec["members"].update(sats_by_comp[offsets[c]:offsets[c + 1]].tolist())
+            rec["max_members"] = max(rec["max_members"], int(comp_size[c]))
+            k = comp_best[c]
+            if dists[k] < rec["min_distance_km"]:
+                rec["min_distance_km"] = float(dists[k])
+                rec["min_pair_a"] = int(min(sat_a[k], sat_b[k]))
+                rec["min_pair_b"] = int(max(sat_a[k], sat_b[k]))
+                rec["min_pair_time"] = t
+            rec["n_pair_detections"] += int(comp_pairs[c])
+
+        # running per-pair stats over every detection
+        for key, d in zip(keys.tolist(), dists.tolist()):
+            st = self.pair_stats.get(key)
+            if st is None:
+                self.pair_stats[key] = [1, d, t, t, t]
+            else:
+                st[0] += 1
+                if d < st[1]:
+                    st[1] = d
+                    st[2] = t
+                st[4] = t
+
+        # keep pairs that are new this timestep, whose satellites changed cluster,
+        # or that are tighter than pair_threshold_km
+        cur_cid = comp_id[labels]
+        sat_changed = prev_cid != cur_cid
+        keep = (
+            ~np.isin(keys, self.prev_pair_keys)
+            | sat_changed[ia]
+            | sat_changed[ib]
+            | (dists < self.pair_threshold_km)
+        )
+        pair_cid = cur_cid[ia]
+        kept = [{**step_events[i], "cluster_id": int(pair_cid[i])} for i in np.flatnonzero(keep)]
+
+        self.prev_sats = sats
+        self.prev_cids = cur_cid
+        self.prev_pair_keys = keys
+        return kept
+
+    def finish(self):
+        self._close(set(self.open))
+        self._reset_prev()
+
+    def _reset_prev(self):
+        self.prev_sats = np.empty(0, dtype=np.int64)
+        self.prev_cids = np.empty(0, dtype=np.int64)
+        self.prev_pair_keys = np.empty(0, dtype=np.int64)
+
+    def pair_summary(self) -> pd.DataFrame:
+        # per-pair stats over the whole run, same columns as the pipeline's pair summary
+        records = [
+            {
+                "satnum_a": key >> 32,
+                "satnum_b": key & 0xFFFFFFFF,
+                "n_detections": n,
+                "min_distance_km": d,
+                "time_of_min": tmin,
+                "first_time": first,
+                "last_time": last,
+            }
+            for key, (n, d, tmin, first, last) in self.pair_stats.items()
+        ]
+        return pd.DataFrame.from_records(records)
+
+    def _close(self, cluster_ids: set):
+        for cid in sorted(cluster_ids):
+            rec = self.open.pop(cid)
+            members = sorted(rec.pop("members"))
+            rec["n_members"] = len(members)
+            rec["members"] = members
+            rec["duration_minutes"] = (rec["last_time"] - rec["first_time"]).total_seconds() / 60.0
+            self.closed.append(rec)
+
+
+def _prepare_traj(traj_df: pd.DataFrame, *, alt_bin_km: float, leobound_km: float,
+                  require_sgp4_ok: bool) -> pd.DataFrame:
+    # validate columns, keep usable LEO rows and add the altitude bin used for pruning.
 
     required = {"time_utc", "satnum", "x_km", "y_km", "z_km", "alt_km", "sgp4_err"}
     missing = required - set(traj_df.columns)
@@ -53,15 +232,16 @@ def detect_close_approaches_kdtree(
 
     # altitude bin for pruning
     df["alt_bin"] = (np.floor(df["alt_km"] / alt_bin_km) * alt_bin_km).astype(int)
+    return df
 
-    events_buffer = []
-    timesteps_processed = 0
 
-    for t, gt in df.groupby("time_utc", sort=True):
-        timesteps_processed += 1
+def _iter_timestep_pairs(df: pd.DataFrame, *, threshold_km: float, alt_bin_km: float):
+    # yield (time, pair events) for each timestep, in time order.
 
+    for t, gt in df.groupby("time_utc", sort=True):
         # build dict of altitude bins for this timestep
         bins = {b: gb for b, gb in gt.groupby("alt_bin", sort=False)}
+        step_events = []
 
         # compare within-bin, and bin to adjacent bin (b + alt_bin_km)
         for b in sorted(bins.keys()):
@@ -80,7 +260,7 @@ def detect_close_approaches_kdtree(
                 diffs = pos_b[pairs[:, 0]] - pos_b[pairs[:, 1]]
                 dists = np.sqrt(np.sum(diffs * diffs, axis=1))
                 for (i, j), dij in zip(pairs, dists):
-                    events_buffer.append(
+                    step_events.append(
                         {
                             "time_utc": t,
                             "satnum_a": int(sats_b[i]),
@@ -105,7 +285,7 @@ def detect_close_approaches_kdtree(
                     diffs = pos_b[cross[:, 0]] - pos_2[cross[:, 1]]
                     dists = np.sqrt(np.sum(diffs * diffs, axis=1))
                     for (i, j), dij in zip(cross, dists):
-                        events_buffer.append(
+                        step_events.append(
                             {
                                 "time_utc": t,
                                 "satnum_a": int(sats_b[i]),
@@ -115,22 +295,94 @@ def detect_close_approaches_kdtree(
                             }
                         )
 
+        yield t, step_events
+
+
+def _write_part(records: list, out_parquet_path: str, suffix: str):
+    chunk = pd.DataFrame.from_records(records)
+    chunk.to_parquet(out_parquet_path.replace(".parquet", f".{suffix}.parquet"), index=False)
+    records.clear()
+
+
+def detect_close_approaches_kdtree(
+    traj_df: pd.DataFrame,
+    *,
+    threshold_km: float,
+    alt_bin_km: float,
+    leobound_km: float,
+    require_sgp4_ok: bool = True,
+    out_parquet_path: Optional[str] = None,
+    flush_every: int = 50,
+) -> pd.DataFrame:
+
+    df = _prepare_traj(traj_df, alt_bin_km=alt_bin_km, leobound_km=leobound_km,
+                       require_sgp4_ok=require_sgp4_ok)
+
+    events_buffer = []
+    timesteps_processed = 0
+
+    for t, step_events in _iter_timestep_pairs(df, threshold_km=threshold_km, alt_bin_km=alt_bin_km):
+        timesteps_processed += 1
+        events_buffer.extend(step_events)
+
         # save to parquet often
         if out_parquet_path and (timesteps_processed % flush_every == 0) and events_buffer:
-            chunk = pd.DataFrame.from_records(events_buffer)
-            part_path = out_parquet_path.replace(".parquet", f".part{timesteps_processed}.parquet")
-            chunk.to_parquet(part_path, index=False)
-            events_buffer.clear()
+            _write_part(events_buffer, out_parquet_path, f"part{timesteps_processed}")
 
     # final save
     if out_parquet_path and events_buffer:
-        chunk = pd.DataFrame.from_records(events_buffer)
-        part_path = out_parquet_path.replace(".parquet", ".partFINAL.parquet")
-        chunk.to_parquet(part_path, index=False)
-        events_buffer.clear()
+        _write_part(events_buffer, out_parquet_path, "partFINAL")
 
     if out_parquet_path:
         return pd.DataFrame()
 
     return pd.DataFrame.from_records(events_buffer)
 
+
+def detect_clusters_kdtree(
+    traj_df: pd.DataFrame,
+    *,
+    threshold_km: float,
+    alt_bin_km: float,
+    leobound_km: float,
+    pair_threshold_km: Optional[float] = None,
+    require_sgp4_ok: bool = True,
+    out_parquet_path: Optional[str] = None,
+    flush_every: int = 50,
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+
+    df = _prepare_traj(traj_df, alt_bin_km=alt_bin_km, leobound_km=leobound_km,
+                       require_sgp4_ok=require_sgp4_ok)
+
+    events_buffer = []
+    timesteps_processed = 0
+    tracker = _ClusterTracker(pair_threshold_km)
+
+    for t, step_events in _iter_timestep_pairs(df, threshold_km=threshold_km, alt_bin_km=alt_bin_km):
+        timesteps_processed += 1
+        events_buffer.extend(tracker.update(t, step_events))
+
+        # save to parquet often
+        if out_parquet_path and (timesteps_processed % flush_every == 0):
+            if events_buffer:
+                _write_part(events_buffer, out_parquet_path, f"part{timesteps_processed}")
+            if tracker.closed:
+                _write_part(tracker.closed, out_parquet_path, f"clusters.part{timesteps_processed}")
+
+    tracker.finish()
+
+    # final save
+    if out_parquet_path:
+        if events_buffer:
+            _write_part(events_buffer, out_parquet_path, "partFINAL")
+        if tracker.closed:
+            _write_part(tracker.closed, out_parquet_path, "clusters.partFINAL")
+        if tracker.pair_stats:
+            tracker.pair_summary().to_parquet(out_parquet_path.replace(".parquet", ".pairstats.parquet"), index=False)
+        return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+
+    return (
+        pd.DataFrame.from_records(events_buffer),
+        pd.DataFrame.from_records(tracker.closed),
+        tracker.pair_summary(),
+    )